@@ -3,7 +3,8 @@
 #
 
 from abc import ABC, abstractmethod
-from typing import Any, BinaryIO, Iterator, Mapping, TextIO, Union
+from functools import lru_cache
+from typing import Any, BinaryIO, Iterator, Mapping, TextIO, Tuple, Union
 
 import pyarrow as pa
 from airbyte_cdk.logger import AirbyteLogger
@@ -100,4 +101,16 @@ class AbstractFileParser(ABC):
         :param reverse: switch to True for PyArrow schema -> Json schema, defaults to False
         :return: converted schema dict
         """
-        return {column: AbstractFileParser.json_type_to_pyarrow_type(json_type, reverse=reverse) for column, json_type in schema.items()}
+        schema_items = tuple(schema.items())
+        try:
+            hash(schema_items)
+        except TypeError:  # unhashable datatypes, can't be cached
+            return {column: AbstractFileParser.json_type_to_pyarrow_type(json_type, reverse=reverse) for column, json_type in schema_items}
+        # the same schemas get converted over and over (per file, per stream) so the conversion is cached per process
+        return dict(_convert_schema_items(schema_items, reverse))
+
+
+@lru_cache(maxsize=128)
+def _convert_schema_items(schema_items: Tuple[Tuple[str, Any], ...], reverse: bool) -> Tuple[Tuple[str, str], ...]:
+    """cached worker for AbstractFileParser.json_schema_to_pyarrow_schema(), the schema is passed as a tuple of items to be hashable"""
+    return tuple((column, AbstractFileParser.json_type_to_pyarrow_type(json_type, reverse=reverse)) for column, json_type in schema_items)
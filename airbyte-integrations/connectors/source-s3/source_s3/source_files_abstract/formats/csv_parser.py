@@ -4,26 +4,44 @@
 
 import csv
 import json
-import tempfile
+import sys
+from types import MappingProxyType
 from typing import Any, BinaryIO, Callable, Iterator, Mapping, Optional, TextIO, Tuple, Union
 
 import pyarrow
 import pyarrow as pa
-import six  # type: ignore[import]
 from pyarrow import csv as pa_csv
+from source_s3.source_files_abstract.file_info import FileInfo
 from source_s3.utils import run_in_external_process
 
 from .abstract_file_parser import AbstractFileParser
 from .csv_spec import CsvFormat
 
-MAX_CHUNK_SIZE = 50.0 * 1024**2  # in bytes
-TMP_FOLDER = tempfile.mkdtemp()
+LARGE_FILE_SIZE = 1024**3  # in bytes
+LARGE_FILE_BLOCK_SIZE = 16 * 1024**2  # in bytes
+# used to pick a block_size when the user hasn't set one, see _estimate_block_size()
+TARGET_BLOCK_ROWS = 4096
+MIN_BLOCK_SIZE = 1024**2  # in bytes
+MAX_BLOCK_SIZE = 64 * 1024**2  # in bytes
+# rough size of a single CSV value (plus its delimiter) for each json type
+ESTIMATED_VALUE_SIZES = {"boolean": 6, "integer": 10, "number": 14, "string": 32}
+DEFAULT_ESTIMATED_VALUE_SIZE = 32
 
 
 class CsvParser(AbstractFileParser):
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
         self.format_model = None
+        # option mappings & pyarrow option objects only depend on self.format so we build them once per parser
+        self.read_options_dict: Optional[Mapping[str, Any]] = None
+        self.parse_options_dict: Optional[Mapping[str, Any]] = None
+        self.advanced_options_dict: Optional[Mapping[str, Any]] = None
+        self.additional_reader_options_dict: Optional[Mapping[str, Any]] = None
+        self.read_options_obj: Optional[pa.csv.ReadOptions] = None
+        self.parse_options_obj: Optional[pa.csv.ParseOptions] = None
+        # the master schema doesn't change for the lifetime of a parser so its pyarrow conversion is done once too
+        self.master_convert_schema: Optional[Mapping[str, Any]] = None
+        self.convert_options_obj: Optional[pa.csv.ConvertOptions] = None
 
     @property
     def is_binary(self) -> bool:
@@ -35,44 +53,120 @@ class CsvParser(AbstractFileParser):
             self.format_model = CsvFormat.parse_obj(self._format)
         return self.format_model
 
+    def _advanced_options(self) -> Mapping[str, Any]:
+        if self.advanced_options_dict is None:
+            self.advanced_options_dict = MappingProxyType(json.loads(self.format.advanced_options))
+        return self.advanced_options_dict
+
+    def _is_block_size_set(self) -> bool:
+        """
+        whether the user set block_size themselves, either in the format or via advanced_options
+        The UI pre-fills the spec default into saved configs, so a block_size equal to that default counts as unset too.
+        """
+        if "block_size" in self._advanced_options():
+            return True
+        fmt = self.format
+        return "block_size" in fmt.__fields_set__ and fmt.block_size != CsvFormat.__fields__["block_size"].default
+
     def _read_options(self) -> Mapping[str, str]:
         """
         https://arrow.apache.org/docs/python/generated/pyarrow.csv.ReadOptions.html
         build ReadOptions object like: pa.csv.ReadOptions(**self._read_options())
         """
-        return {
-            **{"block_size": self.format.block_size, "encoding": self.format.encoding},
-            **json.loads(self.format.advanced_options),
-        }
+        if self.read_options_dict is None:
+            fmt = self.format
+            # read-only view as this mapping is shared by every caller
+            self.read_options_dict = MappingProxyType(
+                {
+                    **{"block_size": fmt.block_size, "encoding": fmt.encoding},
+                    **self._advanced_options(),
+                }
+            )
+        return self.read_options_dict
 
     def _parse_options(self) -> Mapping[str, str]:
         """
         https://arrow.apache.org/docs/python/generated/pyarrow.csv.ParseOptions.html
         build ParseOptions object like: pa.csv.ParseOptions(**self._parse_options())
         """
+        if self.parse_options_dict is None:
+            fmt = self.format
+            # read-only view as this mapping is shared by every caller
+            self.parse_options_dict = MappingProxyType(
+                {
+                    "delimiter": fmt.delimiter,
+                    "quote_char": fmt.quote_char,
+                    "double_quote": fmt.double_quote,
+                    "escape_char": fmt.escape_char,
+                    "newlines_in_values": fmt.newlines_in_values,
+                }
+            )
+        return self.parse_options_dict
 
-        return {
-            "delimiter": self.format.delimiter,
-            "quote_char": self.format.quote_char,
-            "double_quote": self.format.double_quote,
-            "escape_char": self.format.escape_char,
-            "newlines_in_values": self.format.newlines_in_values,
-        }
-
-    def _convert_options(self, json_schema: Mapping[str, Any] = None) -> Mapping[str, Any]:
+    def _convert_options(self, json_schema: Optional[Mapping[str, Any]] = None) -> Mapping[str, Any]:
         """
         https://arrow.apache.org/docs/python/generated/pyarrow.csv.ConvertOptions.html
         build ConvertOptions object like: pa.csv.ConvertOptions(**self._convert_options())
         :param json_schema: if this is passed in, pyarrow will attempt to enforce this schema on read, defaults to None
         """
-        check_utf8 = self.format.encoding.lower().replace("-", "") == "utf8"
+        fmt = self.format
+        check_utf8 = fmt.encoding.lower().replace("-", "") == "utf8"
+        if self.additional_reader_options_dict is None:
+            self.additional_reader_options_dict = MappingProxyType(json.loads(fmt.additional_reader_options))
 
-        convert_schema = self.json_schema_to_pyarrow_schema(json_schema) if json_schema is not None else None
+        if json_schema is None:
+            convert_schema = None
+        elif json_schema is self._master_schema:
+            if self.master_convert_schema is None:
+                self.master_convert_schema = self.json_schema_to_pyarrow_schema(json_schema)
+            convert_schema = self.master_convert_schema
+        else:
+            convert_schema = self.json_schema_to_pyarrow_schema(json_schema)
+        convert_options = {"check_utf8": check_utf8, "column_types": convert_schema}
+        if "include_columns" in self.additional_reader_options_dict:
+            # columns are projected at parse time, so a selected column missing from one file yields nulls rather than failing
+            convert_options["include_missing_columns"] = True
         return {
-            **{"check_utf8": check_utf8, "column_types": convert_schema},
-            **json.loads(self.format.additional_reader_options),
+            **convert_options,
+            **self.additional_reader_options_dict,
         }
 
+    def _estimate_block_size(self) -> Optional[int]:
+        """
+        Wider rows want bigger blocks to amortise pyarrow's per-batch overhead, narrower ones smaller to keep memory down.
+        If block_size hasn't been set by the user (see _is_block_size_set()), this estimates the average row size from the master schema
+        and returns a block_size holding roughly TARGET_BLOCK_ROWS rows, clamped to [MIN_BLOCK_SIZE, MAX_BLOCK_SIZE].
+        :return: estimated block_size in bytes, or None if the configured block_size should be used as is
+        """
+        if self._is_block_size_set() or not self._master_schema:
+            return None
+        row_size = sum(ESTIMATED_VALUE_SIZES.get(str(typ), DEFAULT_ESTIMATED_VALUE_SIZE) for typ in self._master_schema.values())
+        block_size = min(max(TARGET_BLOCK_ROWS * row_size, MIN_BLOCK_SIZE), MAX_BLOCK_SIZE)
+        self.logger.debug(f"estimated row size of {row_size} bytes, using block_size of {block_size} bytes")
+        return block_size
+
+    def _pyarrow_read_options(self) -> pa.csv.ReadOptions:
+        """
+        ReadOptions used to stream records, inference keeps using the configured block_size for its sample
+        """
+        if self.read_options_obj is None:
+            block_size = self._estimate_block_size()
+            if block_size is None:
+                self.read_options_obj = pa.csv.ReadOptions(**self._read_options())
+            else:
+                self.read_options_obj = pa.csv.ReadOptions(**{**self._read_options(), "block_size": block_size})
+        return self.read_options_obj
+
+    def _pyarrow_parse_options(self) -> pa.csv.ParseOptions:
+        if self.parse_options_obj is None:
+            self.parse_options_obj = pa.csv.ParseOptions(**self._parse_options())
+        return self.parse_options_obj
+
+    def _pyarrow_convert_options(self) -> pa.csv.ConvertOptions:
+        if self.convert_options_obj is None:
+            self.convert_options_obj = pa.csv.ConvertOptions(**self._convert_options(self._master_schema))
+        return self.convert_options_obj
+
     def get_inferred_schema(self, file: Union[TextIO, BinaryIO]) -> Mapping[str, Any]:
         """
         https://arrow.apache.org/docs/python/generated/pyarrow.csv.open_csv.html
@@ -82,7 +176,7 @@ class CsvParser(AbstractFileParser):
         """
 
         def infer_schema_process(
-            file_sample: str, read_opts: dict, parse_opts: dict, convert_opts: dict
+            file_sample: bytes, read_opts: dict, parse_opts: dict, convert_opts: dict
         ) -> Tuple[dict, Optional[Exception]]:
             """
             we need to reimport here to be functional on Windows systems since it doesn't have fork()
@@ -92,18 +186,16 @@ class CsvParser(AbstractFileParser):
             This lets us propagate up any errors (that aren't timeouts) and raise correctly.
             """
             try:
-                import tempfile
-
                 import pyarrow as pa
 
-                # writing our file_sample to a temporary file to then read in and schema infer as before
-                with tempfile.TemporaryFile() as fp:
-                    fp.write(file_sample)  # type: ignore[arg-type]
-                    fp.seek(0)
-                    streaming_reader = pa.csv.open_csv(
-                        fp, pa.csv.ReadOptions(**read_opts), pa.csv.ParseOptions(**parse_opts), pa.csv.ConvertOptions(**convert_opts)
-                    )
-                    schema_dict = {field.name: field.type for field in streaming_reader.schema}
+                # reading our file_sample straight from memory rather than round-tripping it through a temporary file
+                streaming_reader = pa.csv.open_csv(
+                    pa.BufferReader(file_sample),
+                    pa.csv.ReadOptions(**read_opts),
+                    pa.csv.ParseOptions(**parse_opts),
+                    pa.csv.ConvertOptions(**convert_opts),
+                )
+                schema_dict = {field.name: field.type for field in streaming_reader.schema}
 
             except Exception as e:
                 # we pass the traceback up otherwise the main process won't know the exact method+line of error
@@ -122,7 +214,8 @@ class CsvParser(AbstractFileParser):
         if not self.format.infer_datatypes:
             return self._get_schema_dict_without_inference(file)
         self.logger.debug("inferring schema")
-        file_sample = file.read(self._read_options()["block_size"] * 2)  # type: ignore[arg-type]
+        read_options = self._read_options()
+        file_sample = file.read(read_options["block_size"] * 2)  # type: ignore[arg-type]
         return run_in_external_process(
             fn=infer_schema_process,
             timeout=4,
@@ -130,8 +223,10 @@ class CsvParser(AbstractFileParser):
             logger=self.logger,
             args=[
                 file_sample,
-                self._read_options(),
-                self._parse_options(),
+                # keep inference of the small sample single-threaded and deterministic
+                {**read_options, "use_threads": False},
+                # plain dicts so these can be pickled over to the external process
+                dict(self._parse_options()),
                 self._convert_options(),
             ],
         )
@@ -139,23 +234,48 @@ class CsvParser(AbstractFileParser):
     # TODO Rename this here and in `_get_schema_dict`
     def _get_schema_dict_without_inference(self, file: Union[TextIO, BinaryIO]) -> Mapping[str, Any]:
         self.logger.debug("infer_datatypes is False, skipping infer_schema")
-        delimiter = self.format.delimiter
-        quote_char = self.format.quote_char
-        reader = csv.reader([six.ensure_text(file.readline())], delimiter=delimiter, quotechar=quote_char)
-        field_names = next(reader)
+        fmt = self.format
+        delimiter = fmt.delimiter
+        quote_char = fmt.quote_char
+        header = file.readline()
+        if isinstance(header, bytes):
+            header = header.decode(fmt.encoding or "utf8")
+        header = header.rstrip("\r\n")
+        if not header:
+            field_names = []
+        elif not quote_char or quote_char not in header:
+            # nothing is quoted so splitting on the delimiter gives the same result as csv.reader
+            field_names = header.split(delimiter)
+        else:
+            field_names = next(csv.reader([header], delimiter=delimiter, quotechar=quote_char))
         return {field_name.strip(): pyarrow.string() for field_name in field_names}
 
-    def stream_records(self, file: Union[TextIO, BinaryIO]) -> Iterator[Mapping[str, Any]]:
+    def _read_options_for_file(self, file_info: Optional[FileInfo] = None) -> pa.csv.ReadOptions:
+        """
+        Files over LARGE_FILE_SIZE get at least LARGE_FILE_BLOCK_SIZE as bigger blocks reduce the per-batch overhead on row-heavy files.
+        A block_size set by the user is always kept as is.
+        """
+        read_options = self._pyarrow_read_options()
+        if (
+            file_info is not None
+            and file_info.size > LARGE_FILE_SIZE
+            and read_options.block_size < LARGE_FILE_BLOCK_SIZE
+            and not self._is_block_size_set()
+        ):
+            self.logger.debug(f"raising block_size to {LARGE_FILE_BLOCK_SIZE} bytes for large file {file_info}")
+            read_options = pa.csv.ReadOptions(**{**self._read_options(), "block_size": LARGE_FILE_BLOCK_SIZE})
+        return read_options
+
+    def _record_batches(self, file: Union[TextIO, BinaryIO], file_info: Optional[FileInfo] = None) -> Iterator[pa.RecordBatch]:
         """
         https://arrow.apache.org/docs/python/generated/pyarrow.csv.open_csv.html
-        PyArrow returns lists of values for each column so we zip() these up into records which we then yield
+        Streams the file block by block to avoid loading the whole file into memory.
         """
-        streaming_reader = pa_csv.open_csv(
-            file,
-            pa.csv.ReadOptions(**self._read_options()),
-            pa.csv.ParseOptions(**self._parse_options()),
-            pa.csv.ConvertOptions(**self._convert_options(self._master_schema)),
-        )
+        read_options = self._read_options_for_file(file_info)
+        parse_options = self._pyarrow_parse_options()
+        convert_options = self._pyarrow_convert_options()
+
+        streaming_reader = pa_csv.open_csv(file, read_options, parse_options, convert_options)
         still_reading = True
         while still_reading:
             try:
@@ -163,12 +283,24 @@ class CsvParser(AbstractFileParser):
             except StopIteration:
                 still_reading = False
             else:
-                batch_dict = batch.to_pydict()
-                batch_columns = [col_info.name for col_info in batch.schema]
-                # this gives us a list of lists where each nested list holds ordered values for a single column
-                # e.g. [ [1,2,3], ["a", "b", "c"], [True, True, False] ]
-                columnwise_record_values = [batch_dict[column] for column in batch_columns]
-                # we zip this to get row-by-row, e.g. [ [1, "a", True], [2, "b", True], [3, "c", False] ]
-                for record_values in zip(*columnwise_record_values):
-                    # create our record of {col: value, col: value} by dict comprehension, iterating through all cols in batch_columns
-                    yield {batch_columns[i]: record_values[i] for i in range(len(batch_columns))}
+                yield batch
+
+    def stream_records(self, file: Union[TextIO, BinaryIO], file_info: Optional[FileInfo] = None) -> Iterator[Mapping[str, Any]]:
+        """
+        https://arrow.apache.org/docs/python/generated/pyarrow.csv.open_csv.html
+        PyArrow returns lists of values for each column so we zip() these up into records which we then yield
+        """
+        batch_columns = None
+        for batch in self._record_batches(file, file_info):
+            if batch_columns is None:
+                # every batch read from a file shares the same schema so we only need the column names once
+                # interned so every record dict shares the same key objects
+                batch_columns = [sys.intern(name) for name in batch.schema.names]
+            # this gives us a list of lists where each nested list holds ordered values for a single column
+            # e.g. [ [1,2,3], ["a", "b", "c"], [True, True, False] ]
+            # any column projection (include_columns) has already been applied by pyarrow so we take every column as is
+            columnwise_record_values = [column.to_pylist() for column in batch.columns]
+            # we zip this to get row-by-row, e.g. [ [1, "a", True], [2, "b", True], [3, "c", False] ]
+            for record_values in zip(*columnwise_record_values):
+                # create our record of {col: value, col: value} by zipping column names with this row's values
+                yield dict(zip(batch_columns, record_values))
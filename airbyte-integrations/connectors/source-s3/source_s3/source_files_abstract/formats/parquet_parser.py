@@ -2,10 +2,11 @@
 # Copyright (c) 2021 Airbyte, Inc., all rights reserved.
 #
 
-from typing import Any, BinaryIO, Iterator, List, Mapping, TextIO, Tuple, Union
+from typing import Any, BinaryIO, Iterator, List, Mapping, Optional, TextIO, Tuple, Union
 
 import pyarrow.parquet as pq
 from pyarrow.parquet import ParquetFile
+from source_s3.source_files_abstract.file_info import FileInfo
 
 from .abstract_file_parser import AbstractFileParser
 from .parquet_spec import ParquetFormat
@@ -99,7 +100,7 @@ class ParquetParser(AbstractFileParser):
             raise OSError("empty Parquet file")
         return schema_dict
 
-    def stream_records(self, file: Union[TextIO, BinaryIO]) -> Iterator[Mapping[str, Any]]:
+    def stream_records(self, file: Union[TextIO, BinaryIO], file_info: Optional[FileInfo] = None) -> Iterator[Mapping[str, Any]]:
         """
         https://arrow.apache.org/docs/python/generated/pyarrow.parquet.ParquetFile.html
         PyArrow reads streaming batches from a Parquet file
@@ -7,7 +7,7 @@ from typing import Any, Mapping, Tuple
 import pyarrow as pa
 import pytest
 from airbyte_cdk import AirbyteLogger
-from source_s3.source_files_abstract.formats.abstract_file_parser import AbstractFileParser
+from source_s3.source_files_abstract.formats.abstract_file_parser import AbstractFileParser, _convert_schema_items
 
 LOGGER = AirbyteLogger()
 
@@ -111,3 +111,25 @@ class TestAbstractFileParserStatics:
             with pytest.raises(Exception) as e_info:
                 AbstractFileParser.json_schema_to_pyarrow_schema(pyarrow_schema, reverse=True)
                 LOGGER.debug(str(e_info))
+
+    def test_json_schema_to_pyarrow_schema_cached(self) -> None:
+        # repeated conversions must come from the cache, keep column order and hand back independent dicts
+        json_schema = {"b": "number", "a": "string"}
+        _convert_schema_items.cache_clear()
+        first = AbstractFileParser.json_schema_to_pyarrow_schema(json_schema)
+        first["extra"] = pa.large_string()
+        second = AbstractFileParser.json_schema_to_pyarrow_schema(json_schema)
+        assert _convert_schema_items.cache_info().hits == 1
+        assert list(second.keys()) == ["b", "a"]
+        assert second == {"b": pa.float64(), "a": pa.large_string()}
+
+    def test_json_schema_to_pyarrow_schema_unhashable(self) -> None:
+        # schemas holding unhashable datatypes fall back to an uncached conversion
+        json_schema = {"b": "number", "a": "string", "c": {"type": "integer"}}
+        _convert_schema_items.cache_clear()
+        assert AbstractFileParser.json_schema_to_pyarrow_schema(json_schema) == {
+            "b": pa.float64(),
+            "a": pa.large_string(),
+            "c": pa.large_string(),
+        }
+        assert _convert_schema_items.cache_info().currsize == 0
@@ -2,19 +2,23 @@
 # Copyright (c) 2021 Airbyte, Inc., all rights reserved.
 #
 
+import io
 import json
 import os
 import random
 import shutil
 import string
+from datetime import datetime
 from pathlib import Path
 from typing import Any, List, Mapping, Tuple
 
+import pyarrow as pa
 import pytest
 from smart_open import open as smart_open
+from source_s3.source_files_abstract.file_info import FileInfo
 from source_s3.source_files_abstract.formats.csv_parser import CsvParser
 
-from .abstract_test_parser import AbstractTestParser, memory_limit
+from .abstract_test_parser import AbstractTestParser, create_by_local_file, memory_limit
 from .conftest import TMP_FOLDER
 
 SAMPLE_DIRECTORY = Path(__file__).resolve().parent.joinpath("sample_files/")
@@ -322,6 +326,65 @@ class TestCsvParser(AbstractTestParser):
                 "line_checks": {},
                 "fails": [],
             },
+            "include_columns_in_reader_options": {
+                # tests column projection at parse time, including a selected column missing from the file
+                "AbstractFileParser": CsvParser(
+                    format={
+                        "filetype": "csv",
+                        "additional_reader_options": json.dumps({"include_columns": ["id", "name", "EXTRA_COLUMN_1"]}),
+                    },
+                    master_schema={"id": "integer", "name": "string", "EXTRA_COLUMN_1": "boolean"},
+                ),
+                "filepath": os.path.join(SAMPLE_DIRECTORY, "csv/test_file_1.csv"),
+                "num_records": 8,
+                "inferred_schema": {"id": "integer", "name": "string", "EXTRA_COLUMN_1": "string"},
+                "line_checks": {
+                    1: {
+                        "id": 1,
+                        "name": "PVdhmjb1",
+                        "EXTRA_COLUMN_1": None,
+                    }
+                },
+                "fails": [],
+            },
+            "infer_datatypes_false": {
+                # tests reading the header only, every column should come back as a string
+                "AbstractFileParser": CsvParser(
+                    format={"filetype": "csv", "infer_datatypes": False},
+                    master_schema={},
+                ),
+                "filepath": os.path.join(SAMPLE_DIRECTORY, "csv/infer_schema_test.csv"),
+                "num_records": 18,
+                "inferred_schema": {
+                    "pk": "string",
+                    "full_name": "string",
+                    "street_address": "string",
+                    "customer_code": "string",
+                    "email": "string",
+                    "dob": "string",
+                },
+                "line_checks": {},
+                "fails": [],
+            },
+            "infer_datatypes_false_custom_params": {
+                # tests reading the header with a custom delimiter & quote_char
+                "AbstractFileParser": CsvParser(
+                    format={"filetype": "csv", "delimiter": ";", "quote_char": "|", "infer_datatypes": False},
+                    master_schema={},
+                ),
+                "filepath": os.path.join(SAMPLE_DIRECTORY, "csv/infer_schema_test_quote_delim.csv"),
+                "num_records": 18,
+                "inferred_schema": {
+                    "pk": "string",
+                    "full_name": "string",
+                    "street_address": "string",
+                    "customer_code": "string",
+                    "email": "string",
+                    "dob": "string",
+                },
+                "line_checks": {},
+                "fails": [],
+            },
             "empty_csv_file": {
                 # tests empty file, SHOULD FAIL INFER & STREAM RECORDS
                 "AbstractFileParser": CsvParser(format={"filetype": "csv"}, master_schema={}),
@@ -383,3 +446,72 @@ class TestCsvParser(AbstractTestParser):
                     read_count += 1
             assert read_count == expected_count
             expected_file.close()
+
+    def test_stream_records_multiple_blocks(self) -> None:
+        """tests that a file spanning several blocks is streamed as one batch per block rather than read whole"""
+        filepath = os.path.join(TMP_FOLDER, "multiple_blocks." + self.filetype)
+        with open(filepath, "w") as f:
+            f.write("id,value\n")
+            f.writelines(f"{i},{i}\n" for i in range(20000))
+        parser = CsvParser(format={"filetype": self.filetype, "block_size": 1024}, master_schema={"id": "integer", "value": "integer"})
+        file_info = create_by_local_file(filepath)
+        with smart_open(filepath, "rb") as f:
+            batches = list(parser._record_batches(f, file_info))
+        assert len(batches) > 1
+        assert sum(batch.num_rows for batch in batches) == 20000
+        with smart_open(filepath, "rb") as f:
+            records = list(parser.stream_records(f, file_info))
+        assert len(records) == 20000
+        assert records[-1] == {"id": 19999, "value": 19999}
+
+    def test_get_inferred_schema_without_inference_quoted_header(self) -> None:
+        """tests that a quoted header field holding the delimiter is kept whole"""
+        parser = CsvParser(format={"filetype": self.filetype, "infer_datatypes": False})
+        file = io.BytesIO(b'id,"last, first",valid\n1,"a, b",True\n')
+        assert parser.get_inferred_schema(file) == {"id": "string", "last, first": "string", "valid": "string"}
+
+    @pytest.mark.parametrize(
+        "format,master_schema,expected_block_size",
+        [
+            ({"filetype": "csv"}, {"id": "integer", "name": "string"}, 1024**2),
+            ({"filetype": "csv"}, {f"column {i}": "string" for i in range(100)}, 4096 * 32 * 100),
+            ({"filetype": "csv"}, {f"column {i}": "string" for i in range(1000)}, 64 * 1024**2),
+            ({"filetype": "csv"}, {}, 10000),
+            ({"filetype": "csv", "block_size": 10000}, {"id": "integer"}, 1024**2),
+            ({"filetype": "csv", "block_size": 2048}, {"id": "integer"}, 2048),
+            ({"filetype": "csv", "advanced_options": json.dumps({"block_size": 4096})}, {"id": "integer"}, 4096),
+        ],
+    )
+    def test_streaming_block_size(self, format: Mapping[str, Any], master_schema: Mapping[str, str], expected_block_size: int) -> None:
+        """tests that block_size is only estimated from the master schema when the user hasn't set it"""
+        parser = CsvParser(format=format, master_schema=master_schema)
+        assert parser._pyarrow_read_options().block_size == expected_block_size
+
+    @pytest.mark.parametrize(
+        "format,file_size,expected_block_size",
+        [
+            ({"filetype": "csv"}, 2 * 1024**3, 16 * 1024**2),
+            ({"filetype": "csv"}, 1024**3, 1024**2),
+            ({"filetype": "csv", "block_size": 10000}, 2 * 1024**3, 16 * 1024**2),
+            ({"filetype": "csv", "block_size": 2048}, 2 * 1024**3, 2048),
+            ({"filetype": "csv", "advanced_options": json.dumps({"block_size": 4096})}, 2 * 1024**3, 4096),
+        ],
+    )
+    def test_large_file_block_size(self, format: Mapping[str, Any], file_size: int, expected_block_size: int) -> None:
+        """tests that files over 1Gb get a bigger block_size unless the user has set one"""
+        parser = CsvParser(format=format, master_schema={"id": "integer"})
+        file_info = FileInfo(key="large_file.csv", size=file_size, last_modified=datetime.now())
+        assert parser._read_options_for_file(file_info).block_size == expected_block_size
+
+    def test_stream_records_untyped_column_conversion_error(self) -> None:
+        """tests that a column missing from master_schema is typed from the first block, whether or not file_info is passed"""
+        filepath = os.path.join(TMP_FOLDER, "untyped_column." + self.filetype)
+        with open(filepath, "w") as f:
+            f.write("id,value\n")
+            f.writelines(f"{i},{i}\n" for i in range(1000))
+            f.write("1000,oops\n")
+        for file_info in (None, create_by_local_file(filepath)):
+            parser = CsvParser(format={"filetype": self.filetype, "block_size": 1024}, master_schema={"id": "integer"})
+            with smart_open(filepath, "rb") as f:
+                with pytest.raises(pa.ArrowInvalid):
+                    list(parser.stream_records(f, file_info))